@@ -520,6 +520,8 @@ class InitialUpgradeRequest:
 
 @dataclass
 class UpdatePlanRequest:
+    __slots__ = ("status", "licenses", "licenses_at_next_renewal", "schedule")
+
     status: Optional[int]
     licenses: Optional[int]
     licenses_at_next_renewal: Optional[int]
@@ -654,7 +656,7 @@ class BillingSession(ABC):
         pass
 
     @abstractmethod
-    def get_customer(self) -> Optional[Customer]:
+    def get_customer(self, *, with_plan_flag: bool = False) -> Optional[Customer]:
         pass
 
     @abstractmethod
@@ -1574,10 +1576,19 @@ class BillingSession(ABC):
             return None, None
         return None, last_ledger_entry
 
-    def get_billing_page_context(self) -> Dict[str, Any]:
-        customer = self.get_customer()
-        assert customer is not None
-        plan = get_current_plan_by_customer(customer)
+    def get_billing_page_context(self, customer: Customer) -> Dict[str, Any]:
+        # Rendering the billing page (and the end-of-cycle updates
+        # below) walks plan.customer and the customer's billing entity,
+        # so we fetch those together with the plan.
+        plan = get_current_plan_by_customer(
+            customer,
+            select_related=(
+                "customer",
+                "customer__realm",
+                "customer__remote_realm",
+                "customer__remote_server",
+            ),
+        )
         context: Dict[str, Any] = {}
         if plan is not None:
             now = timezone_now()
@@ -2415,8 +2426,8 @@ class RealmBillingSession(BillingSession):
         return get_support_url(self.realm)
 
     @override
-    def get_customer(self) -> Optional[Customer]:
-        return get_customer_by_realm(self.realm)
+    def get_customer(self, *, with_plan_flag: bool = False) -> Optional[Customer]:
+        return get_customer_by_realm(self.realm, with_plan_flag=with_plan_flag)
 
     @override
     def get_email(self) -> str:
@@ -2710,8 +2721,8 @@ class RemoteRealmBillingSession(BillingSession):  # nocoverage
         return "TODO:not-implemented"
 
     @override
-    def get_customer(self) -> Optional[Customer]:
-        return get_customer_by_remote_realm(self.remote_realm)
+    def get_customer(self, *, with_plan_flag: bool = False) -> Optional[Customer]:
+        return get_customer_by_remote_realm(self.remote_realm, with_plan_flag=with_plan_flag)
 
     @override
     def get_email(self) -> str:
@@ -3002,8 +3013,8 @@ class RemoteServerBillingSession(BillingSession):  # nocoverage
         return "TODO:not-implemented"
 
     @override
-    def get_customer(self) -> Optional[Customer]:
-        return get_customer_by_remote_server(self.remote_server)
+    def get_customer(self, *, with_plan_flag: bool = False) -> Optional[Customer]:
+        return get_customer_by_remote_server(self.remote_server, with_plan_flag=with_plan_flag)
 
     @override
     def get_email(self) -> str:
@@ -1,9 +1,9 @@
-from typing import Any, Dict, Optional, Union
+from typing import Any, Dict, Optional, Sequence, Union
 
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
 from django.db import models
-from django.db.models import CASCADE, Q
+from django.db.models import CASCADE, Exists, OuterRef, Q, QuerySet
 from typing_extensions import override
 
 from zerver.models import Realm, UserProfile
@@ -52,16 +52,36 @@ class Customer(models.Model):
             return f"{self.remote_server!r} (with stripe_customer_id: {self.stripe_customer_id})"
 
 
-def get_customer_by_realm(realm: Realm) -> Optional[Customer]:
-    return Customer.objects.filter(realm=realm).first()
+def _annotate_with_plan_flag(customers: QuerySet[Customer]) -> QuerySet[Customer]:
+    """Annotates each customer with has_plan: whether it has any
+    CustomerPlan at all, live or not, so that callers that need both
+    don't have to issue a separate query."""
+    return customers.annotate(has_plan=Exists(CustomerPlan.objects.filter(customer=OuterRef("pk"))))
 
 
-def get_customer_by_remote_server(remote_server: RemoteZulipServer) -> Optional[Customer]:
-    return Customer.objects.filter(remote_server=remote_server).first()
+def get_customer_by_realm(realm: Realm, *, with_plan_flag: bool = False) -> Optional[Customer]:
+    customers = Customer.objects.filter(realm=realm)
+    if with_plan_flag:
+        customers = _annotate_with_plan_flag(customers)
+    return customers.first()
 
 
-def get_customer_by_remote_realm(remote_realm: RemoteRealm) -> Optional[Customer]:  # nocoverage
-    return Customer.objects.filter(remote_realm=remote_realm).first()
+def get_customer_by_remote_server(
+    remote_server: RemoteZulipServer, *, with_plan_flag: bool = False
+) -> Optional[Customer]:
+    customers = Customer.objects.filter(remote_server=remote_server)
+    if with_plan_flag:
+        customers = _annotate_with_plan_flag(customers)
+    return customers.first()
+
+
+def get_customer_by_remote_realm(
+    remote_realm: RemoteRealm, *, with_plan_flag: bool = False
+) -> Optional[Customer]:  # nocoverage
+    customers = Customer.objects.filter(remote_realm=remote_realm)
+    if with_plan_flag:
+        customers = _annotate_with_plan_flag(customers)
+    return customers.first()
 
 
 class Event(models.Model):
@@ -337,10 +357,15 @@ class CustomerPlan(models.Model):
         return self.status == CustomerPlan.FREE_TRIAL
 
 
-def get_current_plan_by_customer(customer: Customer) -> Optional[CustomerPlan]:
-    return CustomerPlan.objects.filter(
+def get_current_plan_by_customer(
+    customer: Customer, *, select_related: Sequence[str] = ()
+) -> Optional[CustomerPlan]:
+    plans = CustomerPlan.objects.filter(
         customer=customer, status__lt=CustomerPlan.LIVE_STATUS_THRESHOLD
-    ).first()
+    )
+    if select_related:
+        plans = plans.select_related(*select_related)
+    return plans.first()
 
 
 def get_current_plan_by_realm(realm: Realm) -> Optional[CustomerPlan]:
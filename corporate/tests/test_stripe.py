@@ -4499,6 +4499,23 @@ class BillingHelpersTest(ZulipTestCase):
         customer = Customer.objects.create(realm=realm, stripe_customer_id="cus_12345")
         self.assertEqual(get_customer_by_realm(realm), customer)
 
+        customer_with_flag = get_customer_by_realm(realm, with_plan_flag=True)
+        assert customer_with_flag is not None
+        self.assertEqual(customer_with_flag, customer)
+        self.assertFalse(customer_with_flag.has_plan)  # type: ignore[attr-defined] # from with_plan_flag
+
+        CustomerPlan.objects.create(
+            customer=customer,
+            status=CustomerPlan.ENDED,
+            billing_cycle_anchor=timezone_now(),
+            billing_schedule=CustomerPlan.BILLING_SCHEDULE_ANNUAL,
+            tier=CustomerPlan.TIER_CLOUD_STANDARD,
+        )
+        with self.assert_database_query_count(1):
+            customer_with_flag = get_customer_by_realm(realm, with_plan_flag=True)
+        assert customer_with_flag is not None
+        self.assertTrue(customer_with_flag.has_plan)  # type: ignore[attr-defined] # from with_plan_flag
+
     def test_get_current_plan_by_customer(self) -> None:
         realm = get_realm("zulip")
         customer = Customer.objects.create(realm=realm, stripe_customer_id="cus_12345")
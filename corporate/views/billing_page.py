@@ -1,8 +1,11 @@
 import logging
+from dataclasses import dataclass
+from enum import Enum
+from functools import lru_cache
 from typing import Any, Dict, Optional
 
 from django.http import HttpRequest, HttpResponse, HttpResponseRedirect
-from django.shortcuts import render
+from django.template.loader import get_template
 from django.urls import reverse
 
 from corporate.lib.decorator import (
@@ -10,12 +13,13 @@ from corporate.lib.decorator import (
     authenticated_remote_server_management_endpoint,
 )
 from corporate.lib.stripe import (
+    BillingSession,
     RealmBillingSession,
     RemoteRealmBillingSession,
     RemoteServerBillingSession,
     UpdatePlanRequest,
 )
-from corporate.models import CustomerPlan, get_customer_by_realm
+from corporate.models import Customer, CustomerPlan
 from zerver.decorator import require_billing_access, zulip_login_required
 from zerver.lib.request import REQ, has_request_variables
 from zerver.lib.response import json_success
@@ -26,68 +30,162 @@ from zilencer.models import RemoteRealm, RemoteZulipServer
 
 billing_logger = logging.getLogger("corporate.stripe")
 
-ALLOWED_PLANS_API_STATUS_VALUES = [
-    CustomerPlan.ACTIVE,
-    CustomerPlan.DOWNGRADE_AT_END_OF_CYCLE,
-    CustomerPlan.SWITCH_TO_ANNUAL_AT_END_OF_CYCLE,
-    CustomerPlan.SWITCH_TO_MONTHLY_AT_END_OF_CYCLE,
-    CustomerPlan.FREE_TRIAL,
-    CustomerPlan.DOWNGRADE_AT_END_OF_FREE_TRIAL,
-    CustomerPlan.ENDED,
-]
+ALLOWED_PLANS_API_STATUS_VALUES = frozenset(
+    {
+        CustomerPlan.ACTIVE,
+        CustomerPlan.DOWNGRADE_AT_END_OF_CYCLE,
+        CustomerPlan.SWITCH_TO_ANNUAL_AT_END_OF_CYCLE,
+        CustomerPlan.SWITCH_TO_MONTHLY_AT_END_OF_CYCLE,
+        CustomerPlan.FREE_TRIAL,
+        CustomerPlan.DOWNGRADE_AT_END_OF_FREE_TRIAL,
+        CustomerPlan.ENDED,
+    }
+)
+check_plans_api_status = check_int_in(ALLOWED_PLANS_API_STATUS_VALUES)
 
 
-@zulip_login_required
-@typed_endpoint
-def billing_page(
+def _billing_page_response(request: HttpRequest, context: Dict[str, Any]) -> HttpResponse:
+    return HttpResponse(
+        get_template("corporate/billing.html", using="Jinja2").render(context, request)
+    )
+
+
+@lru_cache(None)
+def _resolve_url(url_name: str) -> str:
+    # URLs that take no arguments resolve to the same path for the
+    # life of the process, so there's no need to walk the URLconf for
+    # them on every request.
+    return reverse(url_name)
+
+
+class BillingPageAction(Enum):
+    REDIRECT_TO_SPONSORSHIP = 1
+    REDIRECT_TO_PLANS = 2
+    REDIRECT_TO_UPGRADE = 3
+    RENDER = 4
+
+
+REDIRECT_URL_FIELDS = {
+    BillingPageAction.REDIRECT_TO_SPONSORSHIP: "sponsorship",
+    BillingPageAction.REDIRECT_TO_PLANS: "plans",
+    BillingPageAction.REDIRECT_TO_UPGRADE: "upgrade",
+}
+
+
+@dataclass(frozen=True)
+class BillingPageURLs:
+    sponsorship: str
+    plans: str
+    upgrade: str
+
+    def redirect_url(self, action: BillingPageAction) -> str:
+        return getattr(self, REDIRECT_URL_FIELDS[action])
+
+
+def _decide_billing_page_action(
+    customer: Optional[Customer],
+    has_plan: bool,
+    *,
+    on_paid_plan: bool,
+    redirect_to_plans: bool,
+) -> BillingPageAction:
+    """Decides, from data that's already been fetched, whether a
+    billing admin should see the billing page or be redirected away
+    from it."""
+    if customer is not None and customer.sponsorship_pending and not on_paid_plan:
+        # Don't redirect to sponsorship page if the billing entity is on a paid plan
+        return BillingPageAction.REDIRECT_TO_SPONSORSHIP
+    if redirect_to_plans:
+        return BillingPageAction.REDIRECT_TO_PLANS
+    if customer is None or not has_plan:
+        return BillingPageAction.REDIRECT_TO_UPGRADE
+    return BillingPageAction.RENDER
+
+
+def _render_billing_page(
     request: HttpRequest,
+    billing_session: BillingSession,
+    customer: Optional[Customer],
+    urls: BillingPageURLs,
     *,
-    success_message: str = "",
+    admin_access: bool,
+    org_name: str,
+    redirect_to_plans: bool,
+    success_message: str,
 ) -> HttpResponse:
-    user = request.user
-    assert user.is_authenticated
-
-    # BUG: This should pass the acting_user; this is just working
-    # around that make_end_of_cycle_updates_if_needed doesn't do audit
-    # logging not using the session user properly.
-    billing_session = RealmBillingSession(user=None, realm=user.realm)
+    # The customer was fetched using get_customer(with_plan_flag=True).
+    has_plan = customer is not None and customer.has_plan  # type: ignore[attr-defined]
+    action = _decide_billing_page_action(
+        customer,
+        has_plan,
+        on_paid_plan=billing_session.on_paid_plan(),
+        redirect_to_plans=redirect_to_plans,
+    )
+    if action is not BillingPageAction.RENDER:
+        return HttpResponseRedirect(urls.redirect_url(action))
+    assert customer is not None
 
     context: Dict[str, Any] = {
-        "admin_access": user.has_billing_access,
+        "admin_access": admin_access,
         "has_active_plan": False,
-        "org_name": user.realm.name,
-        "billing_base_url": "",
+        "org_name": org_name,
+        "billing_base_url": billing_session.billing_base_url,
     }
+    if customer.sponsorship_pending:
+        # The billing entity is on a paid plan, so show the sponsorship
+        # pending message rather than redirecting.
+        context["sponsorship_pending"] = True
 
-    if not user.has_billing_access:
-        return render(request, "corporate/billing.html", context=context)
+    main_context = billing_session.get_billing_page_context(customer)
+    if main_context:
+        context.update(main_context)
+        context["success_message"] = success_message
 
-    if user.realm.plan_type == user.realm.PLAN_TYPE_STANDARD_FREE:
-        return HttpResponseRedirect(reverse("sponsorship_request"))
-
-    customer = get_customer_by_realm(user.realm)
-    if customer is not None and customer.sponsorship_pending:
-        # Don't redirect to sponsorship page if the realm is on a paid plan
-        if not billing_session.on_paid_plan():
-            return HttpResponseRedirect(reverse("sponsorship_request"))
-        # If the realm is on a paid plan, show the sponsorship pending message
-        context["sponsorship_pending"] = True
+    return _billing_page_response(request, context)
 
-    if user.realm.plan_type == user.realm.PLAN_TYPE_LIMITED:
-        return HttpResponseRedirect(reverse("plans"))
 
-    if customer is None:
-        return HttpResponseRedirect(reverse("upgrade_page"))
+@zulip_login_required
+@typed_endpoint
+def billing_page(
+    request: HttpRequest,
+    *,
+    success_message: str = "",
+) -> HttpResponse:
+    user = request.user
+    assert user.is_authenticated
 
-    if not CustomerPlan.objects.filter(customer=customer).exists():
-        return HttpResponseRedirect(reverse("upgrade_page"))
+    if not user.has_billing_access:
+        context: Dict[str, Any] = {
+            "admin_access": False,
+            "has_active_plan": False,
+            "org_name": user.realm.name,
+            "billing_base_url": "",
+        }
+        return _billing_page_response(request, context)
 
-    main_context = billing_session.get_billing_page_context()
-    if main_context:
-        context.update(main_context)
-        context["success_message"] = success_message
+    if user.realm.plan_type == user.realm.PLAN_TYPE_STANDARD_FREE:
+        return HttpResponseRedirect(_resolve_url("sponsorship_request"))
 
-    return render(request, "corporate/billing.html", context=context)
+    # BUG: This should pass the acting_user; this is just working
+    # around that make_end_of_cycle_updates_if_needed doesn't do audit
+    # logging not using the session user properly.
+    billing_session = RealmBillingSession(user=None, realm=user.realm)
+    customer = billing_session.get_customer(with_plan_flag=True)
+    urls = BillingPageURLs(
+        sponsorship=_resolve_url("sponsorship_request"),
+        plans=_resolve_url("plans"),
+        upgrade=_resolve_url("upgrade_page"),
+    )
+    return _render_billing_page(
+        request,
+        billing_session,
+        customer,
+        urls,
+        admin_access=user.has_billing_access,
+        org_name=user.realm.name,
+        redirect_to_plans=user.realm.plan_type == user.realm.PLAN_TYPE_LIMITED,
+        success_message=success_message,
+    )
 
 
 @authenticated_remote_realm_management_endpoint
@@ -98,43 +196,29 @@ def remote_realm_billing_page(
     *,
     success_message: str = "",
 ) -> HttpResponse:  # nocoverage
-    realm_uuid = billing_session.remote_realm.uuid
-    context: Dict[str, Any] = {
-        # We wouldn't be here if user didn't have access.
-        "admin_access": billing_session.has_billing_access(),
-        "has_active_plan": False,
-        "org_name": billing_session.remote_realm.name,
-        "billing_base_url": f"/realm/{realm_uuid}",
-    }
-
-    if billing_session.remote_realm.plan_type == RemoteRealm.PLAN_TYPE_COMMUNITY:
-        return HttpResponseRedirect(reverse("remote_realm_sponsorship_page", args=(realm_uuid,)))
-
-    customer = billing_session.get_customer()
-    if customer is not None and customer.sponsorship_pending:
-        # Don't redirect to sponsorship page if the remote realm is on a paid plan
-        if not billing_session.on_paid_plan():
-            return HttpResponseRedirect(
-                reverse("remote_realm_sponsorship_page", args=(realm_uuid,))
-            )
-        # If the realm is on a paid plan, show the sponsorship pending message
-        context["sponsorship_pending"] = True
-
-    if billing_session.remote_realm.plan_type == RemoteRealm.PLAN_TYPE_SELF_HOSTED:
-        return HttpResponseRedirect(reverse("remote_realm_plans_page", args=(realm_uuid,)))
-
-    if customer is None:
-        return HttpResponseRedirect(reverse("remote_realm_upgrade_page", args=(realm_uuid,)))
-
-    if not CustomerPlan.objects.filter(customer=customer).exists():
-        return HttpResponseRedirect(reverse("remote_realm_upgrade_page", args=(realm_uuid,)))
+    remote_realm = billing_session.remote_realm
+    url_args = (remote_realm.uuid,)
+    urls = BillingPageURLs(
+        sponsorship=reverse("remote_realm_sponsorship_page", args=url_args),
+        plans=reverse("remote_realm_plans_page", args=url_args),
+        upgrade=reverse("remote_realm_upgrade_page", args=url_args),
+    )
 
-    main_context = billing_session.get_billing_page_context()
-    if main_context:
-        context.update(main_context)
-        context["success_message"] = success_message
+    if remote_realm.plan_type == RemoteRealm.PLAN_TYPE_COMMUNITY:
+        return HttpResponseRedirect(urls.sponsorship)
 
-    return render(request, "corporate/billing.html", context=context)
+    customer = billing_session.get_customer(with_plan_flag=True)
+    return _render_billing_page(
+        request,
+        billing_session,
+        customer,
+        urls,
+        # We wouldn't be here if user didn't have access.
+        admin_access=billing_session.has_billing_access(),
+        org_name=remote_realm.name,
+        redirect_to_plans=remote_realm.plan_type == RemoteRealm.PLAN_TYPE_SELF_HOSTED,
+        success_message=success_message,
+    )
 
 
 @authenticated_remote_server_management_endpoint
@@ -145,53 +229,51 @@ def remote_server_billing_page(
     *,
     success_message: str = "",
 ) -> HttpResponse:  # nocoverage
-    context: Dict[str, Any] = {
-        # We wouldn't be here if user didn't have access.
-        "admin_access": billing_session.has_billing_access(),
-        "has_active_plan": False,
-        "org_name": billing_session.remote_server.hostname,
-        "billing_base_url": f"/server/{billing_session.remote_server.uuid}",
-    }
+    remote_server = billing_session.remote_server
+    url_kwargs = {"server_uuid": remote_server.uuid}
+    upgrade_url = reverse("remote_server_upgrade_page", kwargs=url_kwargs)
+    # Servers on the self-hosted plan are sent to the upgrade page,
+    # rather than a plans page.
+    urls = BillingPageURLs(
+        sponsorship=reverse("remote_server_sponsorship_page", kwargs=url_kwargs),
+        plans=upgrade_url,
+        upgrade=upgrade_url,
+    )
 
-    if billing_session.remote_server.plan_type == RemoteZulipServer.PLAN_TYPE_COMMUNITY:
-        return HttpResponseRedirect(
-            reverse(
-                "remote_server_sponsorship_page",
-                kwargs={"server_uuid": billing_session.remote_server.uuid},
-            )
-        )
-
-    customer = billing_session.get_customer()
-    if customer is not None and customer.sponsorship_pending:
-        # Don't redirect to sponsorship page if the remote realm is on a paid plan
-        if not billing_session.on_paid_plan():
-            return HttpResponseRedirect(
-                reverse(
-                    "remote_server_sponsorship_page",
-                    kwargs={"server_uuid": billing_session.remote_server.uuid},
-                )
-            )
-        # If the realm is on a paid plan, show the sponsorship pending message
-        context["sponsorship_pending"] = True
+    if remote_server.plan_type == RemoteZulipServer.PLAN_TYPE_COMMUNITY:
+        return HttpResponseRedirect(urls.sponsorship)
 
-    if (
-        billing_session.remote_server.plan_type == RemoteZulipServer.PLAN_TYPE_SELF_HOSTED
-        or customer is None
-        or not CustomerPlan.objects.filter(customer=customer).exists()
-    ):
-        return HttpResponseRedirect(
-            reverse(
-                "remote_server_upgrade_page",
-                kwargs={"server_uuid": billing_session.remote_server.uuid},
-            )
-        )
-
-    main_context = billing_session.get_billing_page_context()
-    if main_context:
-        context.update(main_context)
-        context["success_message"] = success_message
+    customer = billing_session.get_customer(with_plan_flag=True)
+    return _render_billing_page(
+        request,
+        billing_session,
+        customer,
+        urls,
+        # We wouldn't be here if user didn't have access.
+        admin_access=billing_session.has_billing_access(),
+        org_name=remote_server.hostname,
+        redirect_to_plans=remote_server.plan_type == RemoteZulipServer.PLAN_TYPE_SELF_HOSTED,
+        success_message=success_message,
+    )
 
-    return render(request, "corporate/billing.html", context=context)
+
+def _do_update_plan(
+    request: HttpRequest,
+    billing_session: BillingSession,
+    *,
+    status: Optional[int],
+    licenses: Optional[int],
+    licenses_at_next_renewal: Optional[int],
+    schedule: Optional[int],
+) -> HttpResponse:
+    update_plan_request = UpdatePlanRequest(
+        status=status,
+        licenses=licenses,
+        licenses_at_next_renewal=licenses_at_next_renewal,
+        schedule=schedule,
+    )
+    billing_session.do_update_plan(update_plan_request)
+    return json_success(request)
 
 
 @require_billing_access
@@ -201,7 +283,7 @@ def update_plan(
     user: UserProfile,
     status: Optional[int] = REQ(
         "status",
-        json_validator=check_int_in(ALLOWED_PLANS_API_STATUS_VALUES),
+        json_validator=check_plans_api_status,
         default=None,
     ),
     licenses: Optional[int] = REQ("licenses", json_validator=check_int, default=None),
@@ -210,15 +292,15 @@ def update_plan(
     ),
     schedule: Optional[int] = REQ("schedule", json_validator=check_int, default=None),
 ) -> HttpResponse:
-    update_plan_request = UpdatePlanRequest(
+    billing_session = RealmBillingSession(user=user)
+    return _do_update_plan(
+        request,
+        billing_session,
         status=status,
         licenses=licenses,
         licenses_at_next_renewal=licenses_at_next_renewal,
         schedule=schedule,
     )
-    billing_session = RealmBillingSession(user=user)
-    billing_session.do_update_plan(update_plan_request)
-    return json_success(request)
 
 
 @has_request_variables
@@ -228,7 +310,7 @@ def update_plan_for_remote_realm(
     billing_session: RemoteRealmBillingSession,
     status: Optional[int] = REQ(
         "status",
-        json_validator=check_int_in(ALLOWED_PLANS_API_STATUS_VALUES),
+        json_validator=check_plans_api_status,
         default=None,
     ),
     licenses: Optional[int] = REQ("licenses", json_validator=check_int, default=None),
@@ -237,14 +319,14 @@ def update_plan_for_remote_realm(
     ),
     schedule: Optional[int] = REQ("schedule", json_validator=check_int, default=None),
 ) -> HttpResponse:  # nocoverage
-    update_plan_request = UpdatePlanRequest(
+    return _do_update_plan(
+        request,
+        billing_session,
         status=status,
         licenses=licenses,
         licenses_at_next_renewal=licenses_at_next_renewal,
         schedule=schedule,
     )
-    billing_session.do_update_plan(update_plan_request)
-    return json_success(request)
 
 
 @has_request_variables
@@ -254,7 +336,7 @@ def update_plan_for_remote_server(
     billing_session: RemoteServerBillingSession,
     status: Optional[int] = REQ(
         "status",
-        json_validator=check_int_in(ALLOWED_PLANS_API_STATUS_VALUES),
+        json_validator=check_plans_api_status,
         default=None,
     ),
     licenses: Optional[int] = REQ("licenses", json_validator=check_int, default=None),
@@ -263,11 +345,11 @@ def update_plan_for_remote_server(
     ),
     schedule: Optional[int] = REQ("schedule", json_validator=check_int, default=None),
 ) -> HttpResponse:  # nocoverage
-    update_plan_request = UpdatePlanRequest(
+    return _do_update_plan(
+        request,
+        billing_session,
         status=status,
         licenses=licenses,
         licenses_at_next_renewal=licenses_at_next_renewal,
         schedule=schedule,
     )
-    billing_session.do_update_plan(update_plan_request)
-    return json_success(request)
@@ -167,7 +167,7 @@ def check_int(var_name: str, val: object) -> int:
     return val
 
 
-def check_int_in(possible_values: List[int]) -> Validator[int]:
+def check_int_in(possible_values: Container[int]) -> Validator[int]:
     """
     Assert that the input is an integer and is contained in `possible_values`. If the input is not in
     `possible_values`, a `ValidationError` is raised containing the failing field's name.